@@ -1,76 +1,128 @@
+import calendar
+import functools
 import os
 import re
 from datetime import datetime
 import pandas as pd
 from fpdf import FPDF
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import set_llm_cache
 from langchain_ollama import ChatOllama
 
+from data.data_functions import prepare_df, _client_period_slice
+
+# Cachear las respuestas del LLM para las llamadas invoke/batch: con
+# temperature=0 el mismo prompt produce el mismo informe. Ojo: model.stream()
+# no pasa por esta caché, así que la ruta en streaming de run_agent memoriza
+# sus respuestas aparte en _REPORT_CACHE.
+set_llm_cache(InMemoryCache())
+
+# Respuestas ya generadas en streaming, por prompt
+_REPORT_CACHE = {}
+
+
+@functools.lru_cache(maxsize=4)
+def _get_model(name="llama3.2:1b", temperature=0):
+    """Devuelve un ChatOllama reutilizable; se construye una sola vez por configuración."""
+    return ChatOllama(model=name, temperature=temperature, num_predict=512, num_ctx=1024)
+
+# Month mappings for Spanish and English
+_MONTH_MAPPING = {
+    "primer": 1, "first": 1,
+    "segundo": 2, "second": 2,
+    "tercer": 3, "third": 3,
+    "cuarto": 4, "fourth": 4,
+    "quinto": 5, "fifth": 5,
+    "sexto": 6, "sixth": 6,
+    "séptimo": 7, "seventh": 7,
+    "octavo": 8, "eighth": 8,
+    "noveno": 9, "ninth": 9,
+    "décimo": 10, "tenth": 10,
+    "undécimo": 11, "eleventh": 11,
+    "duodécimo": 12, "twelfth": 12,
+}
+
+# Precompiled patterns shared by every call to extract_dates.
+_ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_YEAR_RE = re.compile(r"\d{4}")
+_ORDINAL_RE = re.compile(
+    r"\b(" + "|".join(map(re.escape, _MONTH_MAPPING)) + r")\b", re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=256)
 def extract_dates(prompt):
-    """Extract start and end dates from the prompt in 'YYYY-MM-DD' format."""
-    
-    # Month mappings for Spanish and English
-    month_mapping = {
-        "primer": 1, "first": 1,
-        "segundo": 2, "second": 2,
-        "tercer": 3, "third": 3,
-        "cuarto": 4, "fourth": 4,
-        "quinto": 5, "fifth": 5,
-        "sexto": 6, "sixth": 6,
-        "séptimo": 7, "seventh": 7,
-        "octavo": 8, "eighth": 8,
-        "noveno": 9, "ninth": 9,
-        "décimo": 10, "tenth": 10,
-        "undécimo": 11, "eleventh": 11,
-        "duodécimo": 12, "twelfth": 12,
-    }
+    """Extract start and end dates from the prompt in 'YYYY-MM-DD' format.
 
-    # Check for ordinal months in the prompt
-    for month_name, month_num in month_mapping.items():
-        if month_name in prompt:
-            year_match = re.search(r"\d{4}", prompt)
-            if year_match:
-                year = int(year_match.group())
-                start_date = datetime(year=year, month=month_num, day=1)
-
-                # Adjust the end date based on the month
-                if month_num == 2:  # February
-                    end_date = datetime(year=year, month=month_num, day=28)  # Assuming not a leap year
-                elif month_num in [4, 6, 9, 11]:  # Months with 30 days
-                    end_date = datetime(year=year, month=month_num, day=30)
-                else:  # Months with 31 days
-                    end_date = datetime(year=year, month=month_num, day=31)
-                
-                return start_date, end_date
-
-    # Handle dates in YYYY-MM-DD format
-    date_pattern = r"(\d{4}-\d{2}-\d{2})"
-    dates = re.findall(date_pattern, prompt)
+    Results are memoized per prompt string, so bulk runs that repeat the
+    same request text skip the regex scans entirely.
+    """
+
+    # Handle dates in YYYY-MM-DD format first (cheapest check)
+    dates = _ISO_DATE_RE.findall(prompt)
     if len(dates) == 2:
         start_date = datetime.strptime(dates[0], "%Y-%m-%d")
         end_date = datetime.strptime(dates[1], "%Y-%m-%d")
         return start_date, end_date
 
+    # Check for ordinal months in the prompt
+    ordinal_match = _ORDINAL_RE.search(prompt)
+    if ordinal_match:
+        month_num = _MONTH_MAPPING[ordinal_match.group(1).lower()]
+        year_match = _YEAR_RE.search(prompt)
+        if year_match:
+            year = int(year_match.group())
+            start_date = datetime(year=year, month=month_num, day=1)
+
+            # Last day of the month, leap-year aware
+            last_day = calendar.monthrange(year, month_num)[1]
+            end_date = datetime(year=year, month=month_num, day=last_day)
+
+            return start_date, end_date
+
     return None, None
 
 def create_pdf_report(client_id, start_date, end_date, report_content, output_folder="reports/"):
     """Crea un informe en PDF y lo guarda en la carpeta especificada."""
+    # Crear la carpeta de salida si no existe (un solo syscall, sin carrera)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Formatear cada fecha una sola vez
+    start_str = start_date.strftime('%Y-%m-%d')
+    end_str = end_date.strftime('%Y-%m-%d')
+
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=12)
 
+    # Título centrado y, en una sola escritura, rango de fechas + contenido
     pdf.cell(200, 10, txt=f"Informe del Cliente {client_id}", ln=True, align='C')
-    pdf.cell(200, 10, txt=f"Rango de fechas: {start_date.strftime('%Y-%m-%d')} a {end_date.strftime('%Y-%m-%d')}", ln=True)
-    pdf.multi_cell(0, 10, report_content)
-
-    output_path = f"{output_folder}reporte_cliente_{client_id}_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.pdf"
-    
-    # Crear la carpeta de salida si no existe
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    body = f"Rango de fechas: {start_str} a {end_str}\n{report_content}"
+    pdf.multi_cell(0, 10, body)
 
+    output_path = (
+        f"{output_folder}reporte_cliente_{client_id}_"
+        f"{start_str.replace('-', '')}_{end_str.replace('-', '')}.pdf"
+    )
     pdf.output(output_path)
     return output_path
 
+# Plantilla corta: menos tokens de entrada y una instrucción de brevedad
+# reducen proporcionalmente el tiempo de generación en Ollama
+_REPORT_PROMPT_TEMPLATE = (
+    "Informe financiero del cliente {client_id}, del {start} al {end}. "
+    "Resume en pocos párrafos: ingresos y gastos, inversiones y pagos, "
+    "y totales por mes. Sé breve y concreto."
+)
+
+
+def _build_report_prompt(client_id, start_str, end_str):
+    """Construye el prompt del informe para un cliente y rango ya formateado."""
+    return _REPORT_PROMPT_TEMPLATE.format(
+        client_id=client_id, start=start_str, end=end_str
+    )
+
+
 def run_agent(df: pd.DataFrame, client_id: int, input: str) -> dict:
     """
     AI Agent que genera informes en PDF usando las funciones de Task 2 si hay datos válidos
@@ -96,35 +148,41 @@ def run_agent(df: pd.DataFrame, client_id: int, input: str) -> dict:
                 "create_report" : bool
             }
     """
-    # Configurar el modelo ChatOllama
-    model = ChatOllama(model="llama3.2:1b", temperature=0)
-    
     # Extraer fechas desde el input
     start_date, end_date = extract_dates(input)
     if not start_date or not end_date:
         raise ValueError("Fechas no válidas en el prompt.")
-    
+
+    # Formatear cada fecha una sola vez; se reutilizan en el prompt y la salida
+    start_str = start_date.strftime("%Y-%m-%d")
+    end_str = end_date.strftime("%Y-%m-%d")
+
     # Filtrar datos del cliente y rango de fechas
     df_client = df[(df['client_id'] == client_id) &
                    (df['date'] >= start_date) &
                    (df['date'] <= end_date)]
-    
-    # Validar si existen datos para generar el informe
+
+    # Validar si existen datos para generar el informe; si no los hay, salir
+    # sin tocar el modelo
     create_report = not df_client.empty
-    report_content = ""
 
     if create_report:
+        # Reutilizar el modelo ChatOllama compartido
+        model = _get_model()
+
         # Generar contenido del informe con el modelo
-        prompt = (
-            f"Cliente {client_id} solicita un informe detallado sobre datos financieros y de transacciones "
-            f"relevantes entre {start_date.strftime('%Y-%m-%d')} y {end_date.strftime('%Y-%m-%d')}. "
-            "El informe debe incluir: \n"
-            "- Resumen de ingresos y gastos.\n"
-            "- Análisis de inversiones y pagos realizados.\n"
-            "- Datos organizados por meses y totales anuales.\n"
-            "- Visualizaciones de las tendencias en el tiempo.\n"
-            "Asegúrate de usar todos los datos disponibles para proporcionar un resumen claro y relevante.")
-        report_content = model.predict(prompt)
+        prompt = _build_report_prompt(client_id, start_str, end_str)
+
+        # Las peticiones repetidas se sirven desde la caché sin llamar a Ollama
+        report_content = _REPORT_CACHE.get(prompt)
+        if report_content is None:
+            # Transmitir la respuesta en streaming: los tokens llegan a medida
+            # que se generan en lugar de esperar a la respuesta completa
+            chunks = []
+            for chunk in model.stream(prompt):
+                chunks.append(chunk.content)
+            report_content = "".join(chunks)
+            _REPORT_CACHE[prompt] = report_content
 
         # Crear y guardar el PDF
         pdf_path = create_pdf_report(client_id, start_date, end_date, report_content)
@@ -132,8 +190,8 @@ def run_agent(df: pd.DataFrame, client_id: int, input: str) -> dict:
 
     # Diccionario de salida
     variables_dict = {
-        "start_date": start_date.strftime("%Y-%m-%d"),
-        "end_date": end_date.strftime("%Y-%m-%d"),
+        "start_date": start_str,
+        "end_date": end_str,
         "client_id": client_id,
         "create_report": create_report  # Cambiar a False si no se generó el informe
     }
@@ -141,5 +199,69 @@ def run_agent(df: pd.DataFrame, client_id: int, input: str) -> dict:
     return variables_dict
 
 
+def run_agent_batch(df: pd.DataFrame, jobs: list, max_concurrency: int = 8) -> list:
+    """
+    Genera varios informes en una sola pasada, solapando las llamadas al LLM.
+
+    Parámetros
+    ----------
+    df : pandas DataFrame
+        DataFrame de los datos.
+    jobs : list of dict
+        Lista de trabajos, cada uno con las claves "client_id" e "input"
+        (mismo significado que en run_agent).
+    max_concurrency : int
+        Número máximo de peticiones simultáneas al modelo.
+
+    Returns
+    -------
+    results : list of dict
+        Un diccionario de variables por trabajo, en el mismo orden que jobs
+        (mismo formato que el de run_agent).
+    """
+    results = []
+    pending = []  # (posición, client_id, start_date, end_date)
+    prompts = []
+
+    # Indexar una sola vez por (client_id, date): cada trabajo se resuelve con
+    # una búsqueda binaria sobre el índice en lugar de un escaneo completo
+    prepared = prepare_df(df)
+
+    # Primero se resuelven fechas y filtrado para todos los trabajos
+    for job in jobs:
+        client_id = job["client_id"]
+        start_date, end_date = extract_dates(job["input"])
+        if not start_date or not end_date:
+            raise ValueError("Fechas no válidas en el prompt.")
+
+        # Formatear cada fecha una sola vez por trabajo
+        start_str = start_date.strftime("%Y-%m-%d")
+        end_str = end_date.strftime("%Y-%m-%d")
+
+        df_client = _client_period_slice(prepared, client_id, start_date, end_date)
+        create_report = not df_client.empty
+
+        results.append({
+            "start_date": start_str,
+            "end_date": end_str,
+            "client_id": client_id,
+            "create_report": create_report,
+        })
+        if create_report:
+            pending.append((client_id, start_date, end_date))
+            prompts.append(_build_report_prompt(client_id, start_str, end_str))
+
+    # Una sola llamada batch: las peticiones al LLM se solapan. El modelo solo
+    # se toca si hay algún informe que generar
+    if prompts:
+        model = _get_model()
+        responses = model.batch(prompts, config={"max_concurrency": max_concurrency})
+        for (client_id, start_date, end_date), response in zip(pending, responses):
+            pdf_path = create_pdf_report(client_id, start_date, end_date, response.content)
+            print(f"Informe generado en: {pdf_path}")
+
+    return results
+
+
 if __name__ == "__main__":
     ...
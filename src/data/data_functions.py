@@ -1,11 +1,77 @@
 import pandas as pd
+import numpy as np
 import os
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import json
 
+# Cargar el mapping de códigos MCC una sola vez al importar el módulo
+_MCC_PATH = os.path.join(
+    os.path.dirname(__file__), '..', '..', 'data', 'raw', 'mcc_codes.json'
+)
+with open(_MCC_PATH, 'r') as _f:
+    _MCC_CODES = json.load(_f)
+
+
+def _to_amount(series: pd.Series) -> pd.Series:
+    """
+    Parse a '$'-prefixed amount column to float64.
+
+    Already-numeric input is returned as float64 directly, so callers can run
+    df['amount'] = _to_amount(df['amount']) once after loading the CSV and the
+    data functions will skip the string processing entirely on every call.
+
+    Arrow-backed string columns (e.g. loaded with dtype_backend='pyarrow') are
+    parsed with Arrow's native string kernels instead of the object-dtype path.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    if isinstance(series.dtype, pd.ArrowDtype):
+        stripped = series.str.removeprefix('$')
+        return stripped.astype('float64[pyarrow]').astype('float64')
+    return pd.to_numeric(series.str.removeprefix('$'), errors='coerce')
+
+
+def prepare_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sort and index a transactions DataFrame by (client_id, date).
+
+    The data functions accept both raw and prepared frames. On a prepared
+    frame each (client, period) lookup is a binary-search slice over the
+    sorted index instead of a full boolean scan, which pays off when the
+    agent issues many queries against the same data.
+    """
+    prepared = df.copy()
+    prepared['date'] = pd.to_datetime(prepared['date'], errors='coerce')
+    return prepared.set_index(['client_id', 'date'], drop=False).sort_index()
+
+
+def _client_period_slice(
+    df: pd.DataFrame, client_id: int, start_date, end_date
+) -> pd.DataFrame:
+    """
+    Rows of one client inside [start_date, end_date], both included.
+
+    Uses an O(log n) index slice when df comes from prepare_df, and falls
+    back to a boolean scan over the raw columns otherwise.
+    """
+    if isinstance(df.index, pd.MultiIndex) and list(df.index.names) == ['client_id', 'date']:
+        # reset_index(drop=True) porque prepare_df conserva las columnas originales
+        return df.loc[(client_id, start_date):(client_id, end_date)].reset_index(drop=True)
+
+    dates = pd.to_datetime(df['date'], errors='coerce')
+    mask = (
+        (df['client_id'] == client_id)
+        & (dates >= pd.to_datetime(start_date))
+        & (dates <= pd.to_datetime(end_date))
+    )
+    return df.loc[mask]
+
 
 def earnings_and_expenses(
-    df: pd.DataFrame, client_id: int, start_date: str, end_date: str
+    df: pd.DataFrame, client_id: int, start_date: str, end_date: str,
+    make_plot: bool = True,
 ) -> pd.DataFrame:
     """
     For the period defined in between start_date and end_date (both included), get the client data available and return
@@ -26,58 +92,48 @@ def earnings_and_expenses(
         Start date for the date period. In the format "YYYY-MM-DD".
     end_date : str
         End date for the date period. In the format "YYYY-MM-DD".
+    make_plot : bool, default True
+        Whether to create and save the bar plot. Pass False to skip the
+        figure rendering when only the DataFrame is needed.
 
     Returns
     -------
     Pandas Dataframe with the earnings and expenses rounded to 2 decimals.
     """
-    df= df.copy()
+    # Filter df by client_id and date period (no full-frame copy needed).
+    sub = _client_period_slice(df, client_id, start_date, end_date)
 
-    # Filter df by client_id and date period.
-    df = df[(df["client_id"] == client_id) & (df["date"] >= start_date) & (df["date"] <= end_date)]
+    # Convert amount to numeric, only on the filtered slice.
+    amount = _to_amount(sub["amount"])
 
-    # Convert amount to numeric.
-    df['amount'] = df['amount'].str.replace('$', '', regex=False)
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-
-    # Create a column earnings if the amount is positive, otherwise expenses.
-    df["Earnings"] = df["amount"].apply(lambda x: x if x > 0 else 0)
-    df["Expenses"] = df["amount"].apply(lambda x: x if x < 0 else 0)
-
-    # Round values to 2 decimals.
-    df = df[["Earnings", "Expenses"]].round(2)
-
-    # Calcula la suma de cada columna
-    sums = df.sum()
+    # Split into earnings (positive) and expenses (negative) with vectorized clips.
+    earnings = amount.clip(lower=0).sum()
+    expenses = amount.clip(upper=0).sum()
 
     # Crear un DataFrame con los totales de ingresos y gastos.
     df = pd.DataFrame({
-        "Earnings": sums["Earnings"],
-        "Expenses": sums["Expenses"]
-    }, index=[0])
-
-    # Round values to 2 decimals.
-    df = df[["Earnings", "Expenses"]].round(2)
-
-    # Select Only Earnings and Expenses columns.
-    df = df[["Earnings", "Expenses"]]
+        "Earnings": [round(earnings, 2)],
+        "Expenses": [round(expenses, 2)]
+    })
 
     # Create a bar plot with expenses absolute values for Expenses.
-    plt.figure(figsize=(10, 6))
-    plt.bar(df.columns, df.iloc[0].abs(), color=["green", "red"])
-    plt.title("Earnings and Expenses")
-    plt.ylabel("Amount")
-    plt.xticks(rotation=0)
-    plt.tight_layout()
+    if make_plot:
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.bar(df.columns, df.iloc[0].abs(), color=["green", "red"])
+        ax.set_title("Earnings and Expenses")
+        ax.set_ylabel("Amount")
+        fig.tight_layout()
 
-    # Save the plot
-    plt.savefig("reports/figures/earnings_and_expenses.png")
+        # Save the plot and release the figure
+        fig.savefig("reports/figures/earnings_and_expenses.png")
+        plt.close(fig)
 
     return df
 
 
 def expenses_summary(
-    df: pd.DataFrame, client_id: int, start_date: str, end_date: str
+    df: pd.DataFrame, client_id: int, start_date: str, end_date: str,
+    make_plot: bool = True,
 ) -> pd.DataFrame:
     """
     For the period defined in between start_date and end_date (both included), get the client data available and return
@@ -104,81 +160,70 @@ def expenses_summary(
         Start date for the date period. In the format "YYYY-MM-DD".
     end_date : str
         End date for the date period. In the format "YYYY-MM-DD".
+    make_plot : bool, default True
+        Whether to create and save the bar plot. Pass False to skip the
+        figure rendering when only the DataFrame is needed.
 
     Returns
     -------
     Pandas DataFrame with the Expenses by merchant category.
     """
     
-    # Crear una copia del DataFrame para no modificar el original
-    df = df.copy()
-
-    # Cargar el mapping de códigos MCC
-    with open('data/raw/mcc_codes.json', 'r') as f:
-        mcc_codes = json.load(f)
-
-    # Limpiar y convertir la columna amount
-    df['amount'] = df['amount'].str.replace('$', '', regex=False)
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-
-    # Convertir las fechas a datetime
-    df['date'] = pd.to_datetime(df['date'])
+    # Convertir los argumentos de fecha a datetime
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
-    # Filtrar por cliente, rango de fechas y solo gastos (valores negativos)
-    mask = (
-        (df['client_id'] == client_id) & 
-        (df['date'] >= start_date) & 
-        (df['date'] <= end_date) &
-        (df['amount'] < 0)
-    )
-    filtered_df = df[mask].copy()
-
-    # Convertir los montos a valores absolutos para los cálculos
-    # filtered_df['amount'] = filtered_df['amount'].abs()
+    # Filtrar por cliente y rango de fechas
+    sub = _client_period_slice(df, client_id, start_date, end_date)
 
-   # Convert mcc codes to string.
-    filtered_df['mcc'] = filtered_df['mcc'].astype(str)
-    # Mapear los códigos MCC a nombres de categoría
-    filtered_df['Expenses Type'] = filtered_df['mcc'].map(mcc_codes)
+    # Copiar solo las columnas que se van a mutar, ya filtradas
+    filtered_df = sub[['amount', 'mcc']].copy()
 
-    # Aplicar agregaciones separadas para cada estadística
-    sum_df = filtered_df.groupby('Expenses Type')['amount'].sum().round(2).rename("Total Amount")
-    mean_df = filtered_df.groupby('Expenses Type')['amount'].mean().round(2).rename("Average")
-    max_df = filtered_df.groupby('Expenses Type')['amount'].max().round(2).rename("Max")
-    min_df = filtered_df.groupby('Expenses Type')['amount'].min().round(2).rename("Min")  
+    # Limpiar y convertir la columna amount, solo en el subconjunto
+    filtered_df['amount'] = _to_amount(filtered_df['amount'])
 
-    # Convertir en absoluto sum_df, mean_df, max_df, min_df
-    sum_df = sum_df.abs()
-    mean_df = mean_df.abs()
-    max_df = max_df.abs()
-    min_df = min_df.abs()
+    # Quedarse solo con los gastos (valores negativos)
+    filtered_df = filtered_df[filtered_df['amount'] < 0]
 
-    # Calcular el máximo y el mínimo utilizando el valor absoluto de 'amount'
-    count_df = filtered_df.groupby('Expenses Type')['amount'].count().rename("Num. Transactions")
+    # Mapear los códigos MCC a nombres de categoría
+    filtered_df['Expenses Type'] = filtered_df['mcc'].astype(str).map(_MCC_CODES)
 
-    # Unir todas las estadísticas en un solo DataFrame
-    summary = pd.concat([sum_df, mean_df, max_df, min_df, count_df], axis=1).reset_index()
+    # Una sola pasada de groupby para todas las estadísticas
+    summary = (
+        filtered_df.groupby('Expenses Type', sort=True)['amount']
+        .agg(['sum', 'mean', 'max', 'min', 'count'])
+        .round(2)
+    )
 
-    # Ordenar alfabéticamente por Expenses Type
-    summary = summary.sort_values('Expenses Type')
-    
-    # Crear el directorio si no existe
-    os.makedirs('reports/figures', exist_ok=True)
-    
-    # Crear gráfico de barras
-    plt.figure(figsize=(12, 6))
-    plt.bar(summary['Expenses Type'], summary['Total Amount'])
-    plt.xticks(rotation=45, ha='right')
-    plt.title(f'Expenses Summary by Category for Client {client_id}\n{start_date.date()} to {end_date.date()}')
-    plt.ylabel('Total Amount')
-    plt.xlabel('Expenses Type')
-    plt.tight_layout()
-    
-    # Guardar el gráfico
-    plt.savefig('reports/figures/expenses_summary.png')
+    # Convertir en absoluto las estadísticas de importe (los gastos son negativos)
+    summary[['sum', 'mean', 'max', 'min']] = summary[['sum', 'mean', 'max', 'min']].abs()
+
+    # Renombrar a los nombres de columna esperados
+    summary = summary.rename(columns={
+        'sum': 'Total Amount',
+        'mean': 'Average',
+        'max': 'Max',
+        'min': 'Min',
+        'count': 'Num. Transactions',
+    }).reset_index()
     
+    if make_plot:
+        # Crear el directorio si no existe
+        os.makedirs('reports/figures', exist_ok=True)
+
+        # Crear gráfico de barras
+        fig, ax = plt.subplots(figsize=(12, 6))
+        ax.bar(summary['Expenses Type'], summary['Total Amount'])
+        plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+        ax.set_title(f'Expenses Summary by Category for Client {client_id}\n{start_date.date()} to {end_date.date()}')
+        ax.set_ylabel('Total Amount')
+        ax.set_xlabel('Expenses Type')
+        fig.tight_layout()
+
+        # Guardar el gráfico y liberar la figura
+        fig.savefig('reports/figures/expenses_summary.png')
+        plt.close(fig)
+
     return summary[['Expenses Type', 'Total Amount', 'Average', 'Max', 'Min', 'Num. Transactions']]
 
 
@@ -217,46 +262,47 @@ def cash_flow_summary(
 
     """
 
-    # Copiar DataFrame para evitar modificar el original
-    df = df.copy()
-    
-    # Convertir la columna de fecha a datetime, forzando errores a NaT (valores no convertibles)
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
     # Convertir los argumentos de fecha a datetime
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
-    df['amount'] = df['amount'].str.replace('$', '', regex=False)
-    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-    
-    # Filtrar datos por cliente, rango de fechas, y eliminar filas con NaT en 'date'
-    mask = (
-        (df['client_id'] == client_id) & 
-        (df['date'] >= start_date) & 
-        (df['date'] <= end_date)
-    )
-    filtered_df = df[mask].dropna(subset=['date']).copy()
+    # Filtrar por cliente y rango de fechas; las filas con NaT no pasan el filtro
+    sub = _client_period_slice(df, client_id, start_date, end_date)
+
+    # Copiar solo la columna amount filtrada y adjuntar la fecha ya convertida
+    filtered_df = sub[['amount']].copy()
+    filtered_df['date'] = pd.to_datetime(sub['date'], errors='coerce')
+
+    # Limpiar y convertir la columna amount, solo en el subconjunto
+    filtered_df['amount'] = _to_amount(filtered_df['amount'])
     
-    # Determinar si el periodo es mayor a 60 días
+    # Determinar si el periodo es mayor a 60 días y agrupar por Period:
+    # el groupby hashea int64 en lugar de strings y no hay strftime por fila
     period_days = (end_date - start_date).days
     if period_days > 60:
-            # Group by month
-            filtered_df['date'] = filtered_df['date'].dt.strftime('%Y-%m')
+        # Group by month
+        filtered_df['date'] = filtered_df['date'].dt.to_period('M')
     else:
-            # Group by week (end of week)
-            filtered_df['date'] = filtered_df['date'].dt.strftime('%Y-%m-%d')
-            filtered_df['date'] = pd.to_datetime(filtered_df['date']).dt.to_period('W').dt.end_time.dt.strftime('%Y-%m-%d')
-    
-    
-    # Calcular inflows, outflows y net cash flow
-    summary = filtered_df.groupby('date').apply(lambda x: pd.Series({
-        'Inflows': x.loc[x['amount'] >= 0, 'amount'].sum(),
-        'Outflows': x.loc[x['amount'] < 0, 'amount'].abs().sum()
-    })).fillna(0)
-    
-    # Calcular Net Cash Flow y % Savings
-    summary['Net Cash Flow'] = summary['Inflows'] - summary['Outflows']
-    summary['% Savings'] = (summary['Net Cash Flow'] / summary['Inflows']).fillna(0) * 100
+        # Group by week
+        filtered_df['date'] = filtered_df['date'].dt.to_period('W')
+
+
+    # Calcular inflows y outflows de forma vectorizada (una pasada por columna)
+    summary = (
+        filtered_df.assign(
+            Inflows=filtered_df['amount'].clip(lower=0),
+            Outflows=(-filtered_df['amount']).clip(lower=0),
+        )
+        .groupby('date', sort=True)[['Inflows', 'Outflows']]
+        .sum()
+    )
+
+    # Calcular Net Cash Flow y % Savings con NumPy, protegiendo la división por cero
+    inflows = summary['Inflows'].to_numpy()
+    net = inflows - summary['Outflows'].to_numpy()
+    summary['Net Cash Flow'] = net
+    with np.errstate(divide='ignore', invalid='ignore'):
+        summary['% Savings'] = np.where(inflows != 0, net / inflows * 100, 0.0)
     
     # Redondear los valores a 2 decimales
     summary = summary.round(2)
@@ -266,9 +312,15 @@ def cash_flow_summary(
 
     # Rename date column to Date.
     summary = summary.rename(columns={'date': 'Date'})
-    
+
     # Ordenar por fecha ascendente
     summary = summary.sort_values(by='Date')
+
+    # Formatear la fecha una sola vez por grupo, no por fila
+    if period_days > 60:
+        summary['Date'] = summary['Date'].astype(str)  # 'YYYY-MM'
+    else:
+        summary['Date'] = summary['Date'].dt.end_time.dt.strftime('%Y-%m-%d')
     
     return summary
 